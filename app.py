@@ -3,14 +3,70 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import folium
-from folium.plugins import HeatMap
+from folium.plugins import HeatMap, MarkerCluster
 from folium import FeatureGroup
-from shapely.geometry import LineString, Point
-from streamlit_folium import st_folium
+import streamlit.components.v1 as components
 import json
+import io
 import os
-import ast
-from typing import List, Tuple, Dict, Optional
+import math
+import functools
+from typing import List, Tuple, Dict, Optional, Iterable
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:  # optional accelerator; NumPy path is used otherwise
+    NUMBA_AVAILABLE = False
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    PYARROW_AVAILABLE = True
+except ImportError:  # pandas' own CSV parser is used otherwise
+    PYARROW_AVAILABLE = False
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:  # stdlib json is used otherwise
+    json_loads = json.loads
+
+try:
+    import python_calamine  # noqa: F401
+    CALAMINE_AVAILABLE = True
+except ImportError:  # pandas' default Excel engine is used otherwise
+    CALAMINE_AVAILABLE = False
+
+EARTH_RADIUS_KM = 6371.0088  # Earth's radius in km (mean)
+
+# Rust-backed calamine parses xlsx/xls several times faster than openpyxl (pandas >= 2.2);
+# None lets pandas pick its default engine otherwise
+PANDAS_VERSION = tuple(int(p) for p in pd.__version__.split(".")[:2])
+EXCEL_ENGINE = "calamine" if CALAMINE_AVAILABLE and PANDAS_VERSION >= (2, 2) else None
+# pandas >= 2.0 can keep sheet columns as Arrow arrays: no per-column NumPy copies on
+# dropna/rename, and numeric coercion runs as Arrow compute kernels
+EXCEL_READ_KWARGS = {"dtype_backend": "pyarrow"} if PYARROW_AVAILABLE and PANDAS_VERSION >= (2, 0) else {}
+
+# Above this many points the heatmap is fed pre-binned grid cells instead of raw points
+HEATMAP_AGGREGATE_THRESHOLD = 50000
+
+# Decimal places kept for coordinates written into the map (~0.1 m, below float32 precision)
+COORD_DECIMALS = 6
+
+# Plain (uncolored) point layers above this size are clustered
+CLUSTER_THRESHOLD = 5000
+
+# Station x line-vertex pairs above which the Numba nearest-line kernel beats the NumPy
+# broadcast even with its one-off compile/cache load (~0.4-1.3 s per process); below it
+# (the bundled network is ~1e5 pairs) the broadcast finishes in milliseconds
+NEAREST_LINE_NUMBA_MIN_PAIRS = 20_000_000
+
+# Normalized (lowercase, no spaces/underscores) column names accepted as lat/lon,
+# in priority order: when several are present the earliest alias wins. Bare "y"/"x" are
+# only used when no column looks like a latitude/longitude at all.
+LAT_ALIASES = ("latitude", "lat", "latdeg", "latitudedeg")
+LON_ALIASES = ("longitude", "lon", "long", "lng", "londeg", "longitudedeg")
 
 # ----------------------------- Utility / Parsing Functions -----------------------------
 
@@ -19,44 +75,72 @@ def find_lat_lon_columns(df: pd.DataFrame) -> Tuple[Optional[str], Optional[str]
     Find likely latitude and longitude column names (case/space insensitive).
     Returns original column names (or (None, None) if not found).
     Searches for variations: lat, latitude, long, lon, longitude
+    Exact alias matches win; substring matching is only a fallback.
     """
-    normalized = {col.lower().strip().replace(" ", "").replace("_", ""): col for col in df.columns}
-    
-    # Search for latitude variations
-    lat_patterns = ["latitude", "lat"]
-    lat_col = None
-    for pattern in lat_patterns:
-        lat_col = next((orig for norm, orig in normalized.items() if pattern in norm), None)
-        if lat_col:
-            break
-    
-    # Search for longitude variations
-    lon_patterns = ["longitude", "long", "lon", "lng"]
-    lon_col = None
-    for pattern in lon_patterns:
-        lon_col = next((orig for norm, orig in normalized.items() if pattern in norm), None)
-        if lon_col:
-            break
-    
+    normalized = {str(col).lower().strip().replace(" ", "").replace("_", ""): col for col in df.columns}
+
+    # Exact alias lookup first, by alias priority (also avoids e.g. "location" matching "lon")
+    lat_col = next((normalized[a] for a in LAT_ALIASES if a in normalized), None)
+    lon_col = next((normalized[a] for a in LON_ALIASES if a in normalized), None)
+
+    # Fall back to substring search for latitude variations
+    if lat_col is None:
+        for pattern in ["latitude", "lat"]:
+            lat_col = next((orig for norm, orig in normalized.items() if pattern in norm), None)
+            if lat_col:
+                break
+
+    # Fall back to substring search for longitude variations
+    if lon_col is None:
+        for pattern in ["longitude", "long", "lon", "lng"]:
+            lon_col = next((orig for norm, orig in normalized.items() if pattern in norm), None)
+            if lon_col:
+                break
+
+    if lat_col is None:
+        lat_col = normalized.get("y")
+    if lon_col is None:
+        lon_col = normalized.get("x")
+
     return lat_col, lon_col
 
 def read_geolocations_from_file(file) -> pd.DataFrame:
     """
     Read CSV or Excel file and return dataframe with normalized lat/lon columns named 'lat' and 'lon'.
-    Supports both .csv and .xlsx/.xls files.
-    Case-insensitive column detection for latitude/longitude variations.
+    Supports both .csv and .xlsx/.xls files (uploaded file objects or paths).
+    Parsing is cached on the file bytes, so Streamlit reruns don't re-parse the same upload.
     If missing, raises ValueError.
     """
     # Get file extension
     file_name = file.name if hasattr(file, 'name') else str(file)
     file_ext = file_name.lower().split('.')[-1]
-    
+
+    if hasattr(file, 'getvalue'):
+        # whole buffer regardless of the current read position (UploadedFile is a BytesIO)
+        data = file.getvalue()
+    elif hasattr(file, 'read'):
+        # other file objects may have been read on an earlier rerun; rewind first
+        file.seek(0)
+        data = file.read()
+    else:
+        with open(file, 'rb') as fh:
+            data = fh.read()
+
+    return parse_geolocations_bytes(data, file_ext)
+
+@st.cache_data(show_spinner=False)
+def parse_geolocations_bytes(data: bytes, file_ext: str) -> pd.DataFrame:
+    """
+    Parse raw CSV/Excel bytes into a dataframe with normalized 'lat' and 'lon' columns.
+    Case-insensitive column detection for latitude/longitude variations.
+    If missing, raises ValueError (errors are not cached).
+    """
     # Read file based on extension
     try:
         if file_ext == 'csv':
-            df = pd.read_csv(file)
+            df = read_csv_bytes(data)
         elif file_ext in ['xlsx', 'xls']:
-            df = pd.read_excel(file)
+            df = pd.read_excel(io.BytesIO(data), engine=EXCEL_ENGINE, **EXCEL_READ_KWARGS)
         else:
             raise ValueError(f"Unsupported file format: .{file_ext}. Please upload CSV or Excel files.")
     except Exception as e:
@@ -73,25 +157,63 @@ def read_geolocations_from_file(file) -> pd.DataFrame:
             f"Please ensure your file has columns like 'Latitude'/'Lat' and 'Longitude'/'Lon'/'Long'."
         )
     
-    df2 = df.copy()
-    df2 = df2.rename(columns={lat_col: "lat", lon_col: "lon"})
-    
-    # Convert to numeric, coercing errors
-    df2["lat"] = pd.to_numeric(df2["lat"], errors='coerce')
-    df2["lon"] = pd.to_numeric(df2["lon"], errors='coerce')
-    
+    # df is local to this call, so rename/clean in place instead of copying it
+    df.rename(columns={lat_col: "lat", lon_col: "lon"}, inplace=True)
+
+    # Convert to numeric in one step, coercing errors (skip columns the Arrow reader already typed)
+    to_convert = [c for c in ("lat", "lon") if not pd.api.types.is_float_dtype(df[c])]
+    if to_convert:
+        df[to_convert] = df[to_convert].apply(pd.to_numeric, errors='coerce')
+
+    # NumPy float32: keeps ~1 m precision for degrees and halves the bytes every later pass
+    # touches. Casting before dropna also turns Arrow NaN values (which Arrow-backed columns
+    # don't count as missing) into ordinary NaN that dropna removes.
+    df[["lat", "lon"]] = df[["lat", "lon"]].astype(np.float32)
+
     # Drop rows with missing coords
-    initial_count = len(df2)
-    df2 = df2.dropna(subset=["lat", "lon"]).reset_index(drop=True)
-    dropped_count = initial_count - len(df2)
-    
+    initial_count = len(df)
+    df.dropna(subset=["lat", "lon"], inplace=True)
+    df.reset_index(drop=True, inplace=True)
+    dropped_count = initial_count - len(df)
+
     if dropped_count > 0:
         print(f"Note: Dropped {dropped_count} rows with invalid or missing coordinates.")
-    
-    if len(df2) == 0:
+
+    if len(df) == 0:
         raise ValueError("No valid coordinate data found in the file after cleaning.")
-    
-    return df2
+
+    return df
+
+def coords_for_json(values) -> np.ndarray:
+    """
+    float64 copy of coordinates rounded to COORD_DECIMALS, for anything serialized into the map.
+    Without the rounding float32 values widen to long decimals (12.97 -> 12.970000267028809).
+    """
+    return np.round(np.asarray(values, dtype=np.float64), COORD_DECIMALS)
+
+def read_csv_bytes(data: bytes) -> pd.DataFrame:
+    """
+    Read CSV bytes with pyarrow's multithreaded reader, typing the lat/lon columns as float64.
+    Falls back to pandas when pyarrow is missing or can't type those columns
+    (e.g. stray text in a coordinate cell, which the caller coerces to NaN instead).
+    """
+    if PYARROW_AVAILABLE:
+        header = pd.read_csv(io.BytesIO(data), nrows=0)
+        lat_col, lon_col = find_lat_lon_columns(header)
+        column_types = {c: pa.float64() for c in (lat_col, lon_col) if c is not None}
+        try:
+            table = pacsv.read_csv(
+                pa.BufferReader(data),
+                convert_options=pacsv.ConvertOptions(column_types=column_types)
+            )
+            df = table.to_pandas(split_blocks=True, self_destruct=True)
+            # pyarrow keeps header names verbatim; reuse pandas' names so repeated headers get
+            # the same "Name.1" suffixes (and blanks the same "Unnamed: i") as pd.read_csv
+            df.columns = header.columns
+            return df
+        except pa.ArrowInvalid:
+            pass
+    return pd.read_csv(io.BytesIO(data))
 
 def parse_coords_input(coords: str) -> Tuple[Optional[float], Optional[float]]:
     """Parse 'lat, lon' text input into floats. Returns (None, None) on error."""
@@ -136,22 +258,45 @@ def haversine_vectorized(lat1, lon1, lat2_arr, lon2_arr):
     and arrays of lat2_arr, lon2_arr. All inputs in degrees.
     Returns numpy array of distances in kilometers.
     """
-    # convert to radians
-    lat1_r = np.radians(lat1)
-    lon1_r = np.radians(lon1)
-    lat2_r = np.radians(lat2_arr)
-    lon2_r = np.radians(lon2_arr)
-
-    dlat = lat2_r - lat1_r
-    dlon = lon2_r - lon1_r
+    # scalar side stays in plain Python math, no ufunc dispatch
+    lat1_r = math.radians(lat1)
+    lon1_r = math.radians(lon1)
+    cos_lat1 = math.cos(lat1_r)
 
-    a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1_r) * np.cos(lat2_r) * (np.sin(dlon / 2.0) ** 2)
-    c = 2 * np.arcsin(np.minimum(1, np.sqrt(a)))
-    R = 6371.0088  # Earth's radius in km (mean)
-    return R * c  # in km
+    # array side: three buffers, everything else is computed in place
+    lat2_r = np.radians(lat2_arr)
+    a = lat2_r - lat1_r
+    a *= 0.5
+    np.sin(a, out=a)
+    a *= a
+
+    dlon = np.radians(lon2_arr)
+    dlon -= lon1_r
+    dlon *= 0.5
+    np.sin(dlon, out=dlon)
+    dlon *= dlon
+
+    np.cos(lat2_r, out=lat2_r)
+    lat2_r *= cos_lat1
+    dlon *= lat2_r
+    a += dlon
+
+    np.sqrt(a, out=a)
+    np.minimum(a, 1.0, out=a)
+    np.arcsin(a, out=a)
+    a *= 2.0 * EARTH_RADIUS_KM
+    return a  # in km
 
 # ----------------------------- Binning & Color Mapping -----------------------------
 
+def count_buckets(bucket_idxs: np.ndarray, n_buckets: int) -> Dict[int, int]:
+    """
+    Points per bucket in one np.bincount pass (unassigned -1 entries are ignored).
+    Returns {bucket_index: count} for every bucket, including empty ones.
+    """
+    counts_arr = np.bincount(bucket_idxs[bucket_idxs >= 0], minlength=n_buckets)
+    return {i: int(counts_arr[i]) for i in range(n_buckets)}
+
 def make_bins_from_radii(radii_meters: List[int]) -> List[Tuple[float, float]]:
     """
     Convert radii (meters) to distance bins in kilometers.
@@ -170,36 +315,55 @@ def make_bins_from_radii(radii_meters: List[int]) -> List[Tuple[float, float]]:
 def bucketize_distances(dist_km: np.ndarray, bins: List[Tuple[float,float]]) -> np.ndarray:
     """
     Given distance array (km) and bins list (low,high), return integer bucket index array.
+    Bins are contiguous from 0 to inf (see make_bins_from_radii), so the bucket index is
+    just the number of upper edges <= distance.
+    """
+    # compare in the distances' own precision (float32 pipeline stays float32)
+    edges = bin_edges(bins, dtype=dist_km.dtype)
+    if len(edges) == 0:
+        return np.zeros(dist_km.shape, dtype=np.intp)
+
+    # Fast path for evenly spaced radii (e.g. 10,20,30 km): direct O(1) index per point
+    step = edges[0]
+    if step > 0 and np.array_equal(edges, step * np.arange(1, len(edges) + 1)):
+        return np.minimum((dist_km / step).astype(np.intp), len(edges))
+
+    return np.searchsorted(edges, dist_km, side="right").astype(np.intp)
+
+def bin_edges(bins: List[Tuple[float,float]], dtype=np.float64) -> np.ndarray:
+    """Upper edges of all bins except the open-ended last one, as a float array."""
+    return np.array([high for _, high in bins[:-1]], dtype=dtype)
+
+def compute_distance_buckets(lat0: float, lon0: float, lat_arr: np.ndarray, lon_arr: np.ndarray,
+                             bins: List[Tuple[float,float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Distance (km) from (lat0, lon0) to every point plus its bucket index.
     """
-    # vectorized approach: iterate over bins and assign
-    bucket_idxs = np.full(dist_km.shape, -1, dtype=int)
-    for i, (low, high) in enumerate(bins):
-        mask = (dist_km >= low) & (dist_km < high)
-        bucket_idxs[mask] = i
-    return bucket_idxs
+    dist_km = haversine_vectorized(lat0, lon0, lat_arr, lon_arr)
+    return dist_km, bucketize_distances(dist_km, bins)
+
+# Bucket colors, nearest first; cycled when there are more buckets than colors
+BASE_PALETTE = (
+    "#1a9850",  # green
+    "#fee08b",  # yellow-ish
+    "#fdae61",  # orange
+    "#f46d43",  # deep orange
+    "#d73027",  # red
+    "#542788",  # purple
+    "#4575b4",  # blue
+    "#000000",  # black
+    "#2b8cbe",  # teal
+    "#66c2a5",  # light green
+)
 
 def make_color_palette(n: int) -> List[str]:
     """
-    Return n distinct colors. Uses a simple palette cycle; extend as needed.
+    Return n distinct colors from BASE_PALETTE, cycling if more buckets than colors.
     Prioritize speed: no external libs.
     """
-    base = [
-        "#1a9850",  # green
-        "#fee08b",  # yellow-ish
-        "#fdae61",  # orange
-        "#f46d43",  # deep orange
-        "#d73027",  # red
-        "#542788",  # purple
-        "#4575b4",  # blue
-        "#000000",  # black
-        "#2b8cbe",  # teal
-        "#66c2a5",  # light green
-    ]
-    if n <= len(base):
-        return base[:n]
-    # expand by cycling if more buckets than base
-    colors = [base[i % len(base)] for i in range(n)]
-    return colors
+    if n <= len(BASE_PALETTE):
+        return list(BASE_PALETTE[:n])
+    return [BASE_PALETTE[i % len(BASE_PALETTE)] for i in range(n)]
 
 def bucket_labels_from_bins(bins: List[Tuple[float,float]]) -> List[str]:
     """Human readable labels for bins, in km with 1 decimal if needed."""
@@ -211,12 +375,31 @@ def bucket_labels_from_bins(bins: List[Tuple[float,float]]) -> List[str]:
             labels.append(f"{low:.2f}–{high:.2f} km")
     return labels
 
+@functools.lru_cache(maxsize=32)
+def bins_labels_colors(radii_tuple: Tuple[int, ...]) -> Tuple[tuple, tuple, tuple]:
+    """
+    Bins, labels and colors for a radii tuple, memoized since most reruns reuse the same radii.
+    Returned as tuples so the shared cached values can't be mutated by callers.
+    """
+    bins = make_bins_from_radii(list(radii_tuple))
+    return tuple(bins), tuple(bucket_labels_from_bins(bins)), tuple(make_color_palette(len(bins)))
+
 # ----------------------------- Metro / Hyderabad Parsing (kept modular) -----------------------------
 
+def empty_stations():
+    """Station set in SoA form: (S, 2) lat/lon array plus a parallel names array."""
+    return {"locs": np.empty((0, 2), dtype=np.float64), "names": np.empty(0, dtype=str)}
+
 def read_metro_data_from_geojson(file):
-    data = json.load(file)
+    """
+    Parse metro GeoJSON into lines and stations, stored as arrays rather than per-vertex tuples:
+    each line gets 'coords' as an (n, 2) lat/lon array, stations come back as
+    {'locs': (S, 2) lat/lon array, 'names': (S,) array}.
+    """
+    data = json_loads(file.read())
     metro_lines = []
-    all_stations = []
+    station_locs = []
+    station_names = []
 
     for feature in data["features"]:
         geometry_type = feature["geometry"]["type"]
@@ -226,95 +409,244 @@ def read_metro_data_from_geojson(file):
         name = props.get("name") or props.get("Name")
 
         if geometry_type == "LineString":
-            # GeoJSON: coordinates are [lon, lat, ...]
-            line_coords = [(lat, lon) for lon, lat, *_ in coordinates]
+            # GeoJSON: coordinates are [lon, lat, ...]; swap to (lat, lon) in one fancy-index copy
+            arr = np.asarray(coordinates, dtype=np.float64)
+            line_coords = arr[:, [1, 0]] if arr.ndim == 2 else np.empty((0, 2), dtype=np.float64)
             metro_lines.append({
                 "name": name or f"Metro Line {len(metro_lines) + 1}",
                 "color": color,
-                "line": line_coords,
-                "stations": []
+                "coords": line_coords,
+                "stations": empty_stations()
             })
 
         elif geometry_type == "Point":
-            all_stations.append({
-                "location": (coordinates[1], coordinates[0]),
-                "name": name or "Unknown Station"
-            })
-
-    return metro_lines, all_stations
+            station_locs.append((coordinates[1], coordinates[0]))
+            station_names.append(name or "Unknown Station")
+
+    stations = {
+        "locs": np.asarray(station_locs, dtype=np.float64).reshape(-1, 2),
+        # fixed-width unicode, not object: st.cache_data hashes arrays by their raw bytes,
+        # which for object arrays are per-process pointers that change on every cache hit
+        "names": np.asarray(station_names, dtype=str)
+    }
+    return metro_lines, stations
+
+def nearest_line_numpy(pts: np.ndarray, line_pts: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Index of the nearest line for every point. Lines are stored CSR-style: line l owns
+    line_pts[offsets[l]:offsets[l+1]]. Every point is projected onto every segment in
+    a single NumPy broadcast.
+    """
+    # a segment starts at every vertex except the last one of its line
+    is_last = np.zeros(len(line_pts), dtype=bool)
+    is_last[offsets[1:] - 1] = True
+    start_idx = np.nonzero(~is_last)[0]
+    seg_to_line_idx = np.searchsorted(offsets, start_idx, side="right") - 1
+
+    a = line_pts[start_idx]                   # (M, 2)
+    ab = line_pts[start_idx + 1] - a          # (M, 2)
+
+    # projection parameter of each point onto each segment, clamped to the segment
+    ap = pts[:, None, :] - a[None, :, :]      # (S, M, 2)
+    ab_len2 = (ab * ab).sum(-1)               # (M,)
+    t = np.divide((ap * ab).sum(-1), ab_len2, out=np.zeros(ap.shape[:2]), where=ab_len2 > 0)
+    np.clip(t, 0.0, 1.0, out=t)
+    diff = ap - t[..., None] * ab             # point minus closest point on segment
+    dist2 = (diff * diff).sum(-1)             # (S, M)
+
+    return seg_to_line_idx[dist2.argmin(axis=1)]
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True)
+    def _nearest_line(pts, line_pts, offsets, bboxes):
+        """
+        Numba version of nearest_line_numpy: stations in parallel, no (S, M) temporaries.
+        bboxes[l] = (min_y, max_y, min_x, max_x) of line l; a line whose box is already
+        farther away than the best segment so far cannot win and is skipped whole.
+        """
+        n_lines = offsets.shape[0] - 1
+        out = np.empty(pts.shape[0], dtype=np.intp)
+        for s in prange(pts.shape[0]):
+            py = pts[s, 0]
+            px = pts[s, 1]
+            best = np.inf
+            best_line = 0
+            for l in range(n_lines):
+                oy = max(bboxes[l, 0] - py, py - bboxes[l, 1], 0.0)
+                ox = max(bboxes[l, 2] - px, px - bboxes[l, 3], 0.0)
+                if oy * oy + ox * ox >= best:
+                    continue
+                for k in range(offsets[l], offsets[l + 1] - 1):
+                    ay = line_pts[k, 0]
+                    ax = line_pts[k, 1]
+                    aby = line_pts[k + 1, 0] - ay
+                    abx = line_pts[k + 1, 1] - ax
+                    apy = py - ay
+                    apx = px - ax
+                    den = aby * aby + abx * abx
+                    t = 0.0
+                    if den > 0.0:
+                        t = min(max((apy * aby + apx * abx) / den, 0.0), 1.0)
+                    dy = apy - t * aby
+                    dx = apx - t * abx
+                    d2 = dy * dy + dx * dx
+                    if d2 < best:
+                        best = d2
+                        best_line = l
+            out[s] = best_line
+        return out
 
 def assign_stations_to_closest_line(metro_lines, stations):
-    for station in stations:
-        min_distance = float("inf")
-        closest_line = None
-        station_point = Point(station["location"][1], station["location"][0])
-
-        for line in metro_lines:
-            line_geom = LineString([(lon, lat) for lat, lon in line["line"]])
-            distance = station_point.distance(line_geom)
-            if distance < min_distance:
-                min_distance = distance
-                closest_line = line
+    """
+    Attach each station to the metro line with the nearest segment.
+    Coordinates are first put in a local equirectangular projection (longitude scaled by
+    cos(latitude)) so distances track ground distance instead of raw degrees.
+    Each line's 'stations' becomes the slice of the station arrays assigned to it, and
+    stations['line_idx'] records the owning line per station.
+    """
+    locs = stations["locs"]
+    if len(locs) == 0 or not any(len(line["coords"]) >= 2 for line in metro_lines):
+        return metro_lines
+
+    scale = np.array([1.0, math.cos(math.radians(float(locs[:, 0].mean())))])
+    pts = locs * scale
+    line_pts = np.concatenate([line["coords"] for line in metro_lines]) * scale
+    offsets = np.zeros(len(metro_lines) + 1, dtype=np.intp)
+    offsets[1:] = np.cumsum([len(line["coords"]) for line in metro_lines])
+
+    if NUMBA_AVAILABLE and len(pts) * len(line_pts) >= NEAREST_LINE_NUMBA_MIN_PAIRS:
+        # empty lines get an inverted box so the prefilter always skips them
+        bboxes = np.array([
+            (c[:, 0].min(), c[:, 0].max(), c[:, 1].min(), c[:, 1].max()) if len(c) else (np.inf, -np.inf, np.inf, -np.inf)
+            for c in np.split(line_pts, offsets[1:-1])
+        ]).reshape(-1, 4)
+        best_line = _nearest_line(pts, line_pts, offsets, bboxes)
+    else:
+        best_line = nearest_line_numpy(pts, line_pts, offsets)
 
-        if closest_line:
-            closest_line["stations"].append(station)
+    stations["line_idx"] = best_line
+    for line_idx, line in enumerate(metro_lines):
+        mask = best_line == line_idx
+        line["stations"] = {"locs": locs[mask], "names": stations["names"][mask]}
 
     return metro_lines
 
+@st.cache_data(show_spinner=False)
+def load_metro_groups(geojson_bytes: bytes):
+    """
+    Parse metro GeoJSON bytes and assign stations to lines.
+    Cached on the file bytes so reruns skip both the JSON parse and the assignment.
+    """
+    metro_lines, stations = read_metro_data_from_geojson(io.BytesIO(geojson_bytes))
+    return assign_stations_to_closest_line(metro_lines, stations)
+
 def add_metro_layers(m, metro_groups):
     for group in metro_groups:
         layer = FeatureGroup(name=group["name"], show=True)
 
         # Add metro line
         folium.PolyLine(
-            group["line"],
+            group["coords"].tolist(),
             color=group["color"],
             weight=4,
             opacity=1.0
         ).add_to(layer)
 
-        # Add stations
-        for station in group["stations"]:
-            folium.CircleMarker(
-                location=station["location"],
-                radius=5,
-                color="black",
-                fill=True,
-                fill_color=group["color"],
-                fill_opacity=0.8
+        # Add stations: one GeoJSON FeatureCollection per line instead of a CircleMarker each
+        stations = group["stations"]
+        if len(stations["locs"]):
+            features = [
+                {
+                    "type": "Feature",
+                    "geometry": {"type": "Point", "coordinates": lon_lat},
+                    "properties": {"name": str(name)}
+                }
+                for lon_lat, name in zip(coords_for_json(stations["locs"][:, ::-1]).tolist(), stations["names"])
+            ]
+            folium.GeoJson(
+                {"type": "FeatureCollection", "features": features},
+                marker=folium.CircleMarker(radius=5),
+                style_function=lambda feature, color=group["color"]: {
+                    "color": "black",
+                    "fill": True,
+                    "fillColor": color,
+                    "fillOpacity": 0.8
+                }
             ).add_to(layer)
 
         layer.add_to(m)
 
 
-def add_hyderabad_metro(map_obj, lines_file, stations_file):
+@st.cache_data(show_spinner=False)
+def load_hyderabad_metro(lines_file, stations_file) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Read the Hyderabad metro CSVs and parse the 'coords' text columns once.
+    Line coords ("[(lat, lon), ...]") become (n, 2) arrays via the JSON parser, and station
+    coords ("(lat, lon)") are split into float 'lat'/'lon' columns with one vectorized regex.
+    Cached so reruns don't re-read the CSVs or re-parse the text.
+    """
     df_lines = pd.read_csv(lines_file)
     df_stations = pd.read_csv(stations_file)
+    df_lines["coords"] = df_lines["coords"].map(
+        lambda c: np.asarray(json_loads(c.replace("(", "[").replace(")", "]")), dtype=np.float64).reshape(-1, 2)
+        if isinstance(c, str) else np.empty((0, 2))
+    )
+    latlon = df_stations["coords"].astype(str).str.extract(r"\(\s*([^,\s]+)\s*,\s*([^)\s]+)\s*\)")
+    df_stations["lat"] = pd.to_numeric(latlon[0], errors="coerce")
+    df_stations["lon"] = pd.to_numeric(latlon[1], errors="coerce")
+    df_stations.dropna(subset=["lat", "lon"], inplace=True)
+    return df_lines, df_stations
+
+def add_hyderabad_metro(map_obj, lines_file, stations_file):
+    df_lines, df_stations = load_hyderabad_metro(lines_file, stations_file)
 
     lines_group = FeatureGroup(name='Hyderabad Metro Lines')
-    for _, row in df_lines.iterrows():
-        coords = row['coords']
-        if isinstance(coords, str):
-            coords = ast.literal_eval(coords)
-        coords = [[lat, lon] for lat, lon in coords]
-        folium.PolyLine(coords, color=row.get('Color', 'blue'), weight=5, opacity=0.7).add_to(lines_group)
+    line_colors = df_lines['Color'] if 'Color' in df_lines.columns else pd.Series('blue', index=df_lines.index)
+    # All lines in one GeoJSON layer, each feature carrying its own color
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": coords[:, ::-1].tolist()},
+            "properties": {"color": color}
+        }
+        for coords, color in zip(df_lines['coords'].values, line_colors.values)
+        if len(coords) >= 2
+    ]
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        style_function=lambda feature: {
+            "color": feature["properties"]["color"],
+            "weight": 5,
+            "opacity": 0.7
+        }
+    ).add_to(lines_group)
     lines_group.add_to(map_obj)
 
     stations_group = FeatureGroup(name='Hyderabad Metro Stations')
-    for _, row in df_stations.iterrows():
-        coords = row['coords']
-        if isinstance(coords, str):
-            coords = ast.literal_eval(coords)
-        coords = [coords[0], coords[1]]
-        folium.CircleMarker(
-            location=coords,
-            radius=5,
-            color='black',
-            fill=True,
-            fill_color=row.get('color', 'blue'),
-            fill_opacity=0.7,
-            popup=row.get('Station', 'Unknown Station')
-        ).add_to(stations_group)
+    station_colors = df_stations['color'] if 'color' in df_stations.columns else pd.Series('blue', index=df_stations.index)
+    station_names = (df_stations['Station'] if 'Station' in df_stations.columns
+                     else pd.Series('Unknown Station', index=df_stations.index))
+    # One GeoJSON layer for all stations; color and name travel as feature properties
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {"name": str(name), "color": color}
+        }
+        for lat, lon, color, name in zip(df_stations['lat'].tolist(), df_stations['lon'].tolist(),
+                                         station_colors.values, station_names.values)
+    ]
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        marker=folium.CircleMarker(radius=5),
+        style_function=lambda feature: {
+            "color": "black",
+            "fill": True,
+            "fillColor": feature["properties"]["color"],
+            "fillOpacity": 0.7
+        },
+        popup=folium.GeoJsonPopup(fields=["name"], labels=False)
+    ).add_to(stations_group)
     stations_group.add_to(map_obj)
 
 # ----------------------------- Map Drawing Helpers -----------------------------
@@ -330,16 +662,33 @@ def add_concentric_circles(map_obj, lat, lon, radii_meters=[10000, 20000, 30000]
         icon=folium.Icon(color="darkred", icon="building", prefix="fa")
     ).add_to(layer)
 
+    # All rings go out as one GeoJSON layer (64-segment polylines computed with NumPy)
+    # instead of one Leaflet circle object per radius.
+    theta = np.linspace(0, 2 * np.pi, 65)
+    cos_t, sin_t = np.cos(theta), np.sin(theta)
+    # same sphere as the distance buckets, so a point on a ring is bucketed at that radius
+    meters_per_deg_lat = math.radians(EARTH_RADIUS_KM * 1000.0)
+    meters_per_deg_lon = meters_per_deg_lat * math.cos(math.radians(lat))
+    features = []
     for r in radii_meters:
-        folium.Circle(
-            location=[lat, lon],
-            radius=int(r),
-            color=color,
-            fill=False,
-            weight=2,
-            opacity=0.6,
-            dash_array="8,6"
-        ).add_to(layer)
+        ring_lat = lat + (r / meters_per_deg_lat) * cos_t
+        ring_lon = lon + (r / meters_per_deg_lon) * sin_t
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": np.column_stack([ring_lon, ring_lat]).tolist()},
+            "properties": {"radius_m": int(r)}
+        })
+
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        style_function=lambda feature: {
+            "color": color,
+            "weight": 2,
+            "opacity": 0.6,
+            "dashArray": "8,6",
+            "fill": False
+        }
+    ).add_to(layer)
 
     layer.add_to(map_obj)
 
@@ -352,40 +701,68 @@ def add_colored_points_layer(map_obj, df: pd.DataFrame, lat_col: str, lon_col: s
     """
     layer = FeatureGroup(name=layer_name, show=True)
 
-    # Iterate row-wise here: unavoidable for folium markers; keep it as light as possible.
-    for i, row in df.iterrows():
-        bidx = int(bucket_idxs[i]) if i < len(bucket_idxs) else -1
-        # fallback color:
-        fill_color = fill_colors[bidx] if (0 <= bidx < len(fill_colors)) else "#3186cc"
-        popup_html = (
-            f"<b>Record:</b><br>"
-            f"{row.to_dict()}<br>"
-            f"<b>Distance (km):</b> {row.get('distance_km', np.nan):.3f}<br>"
-            f"<b>Range:</b> {bucket_labels[bidx] if (0 <= bidx < len(bucket_labels)) else 'N/A'}"
-        )
+    lat = coords_for_json(df[lat_col]).tolist()
+    lon = coords_for_json(df[lon_col]).tolist()
+    bucket_list = bucket_idxs.tolist()
+
+    # Precompute colors and popups up front so the marker loop below only indexes lists.
+    colors_arr = [fill_colors[b] if 0 <= b < len(fill_colors) else "#3186cc" for b in bucket_list]
+    popups = build_points_popup_html(df, bucket_idxs, bucket_labels)
+
+    # Marker construction is unavoidable per point for folium; keep the loop body minimal.
+    for i in range(len(df)):
         folium.CircleMarker(
-            location=(row[lat_col], row[lon_col]),
+            location=(lat[i], lon[i]),
             radius=5,
             color="black",
             weight=1,
             fill=True,
-            fill_color=fill_color,
+            fill_color=colors_arr[i],
             fill_opacity=0.9,
-            popup=popup_html
+            popup=popups[i]
         ).add_to(layer)
 
     layer.add_to(map_obj)
-    
-    # Calculate bucket counts
-    bucket_counts = {}
-    for i in range(len(bucket_labels)):
-        count = np.sum(bucket_idxs == i)
-        bucket_counts[i] = count
-    
-    return bucket_counts
 
-def add_simple_points_layer(map_obj, geolocations: List[Tuple[float,float]], color="red", layer_name="Pickup Points"):
-    layer = FeatureGroup(name=layer_name, show=True)
+    return count_buckets(bucket_idxs, len(bucket_labels))
+
+def build_points_popup_html(df: pd.DataFrame, bucket_idxs: np.ndarray, bucket_labels: List[str]) -> List[str]:
+    """
+    Popup HTML for every row (record fields, distance, range), built column-wise with
+    pandas string ops instead of a per-row dict + f-string.
+    """
+    if df.empty:
+        return []
+    # string dtypes keep blank cells missing through astype(str); fill them so one blank
+    # cell doesn't turn the whole concatenated popup into NaN
+    pieces = [df[c].astype(str).fillna("nan").radd(f"{c}: ") for c in df.columns]
+    record_html = pieces[0].str.cat(pieces[1:], sep="<br>") if len(pieces) > 1 else pieces[0]
+
+    if "distance_km" in df.columns:
+        dist_str = df["distance_km"].map("{:.3f}".format)
+    else:
+        dist_str = pd.Series("nan", index=df.index)
+
+    # bucket index -1 (unassigned) picks the trailing 'N/A'
+    range_labels = np.array(list(bucket_labels) + ["N/A"], dtype=object)[bucket_idxs]
+
+    popups = (
+        "<b>Record:</b><br>" + record_html
+        + "<br><b>Distance (km):</b> " + dist_str
+        + "<br><b>Range:</b> " + pd.Series(range_labels, index=df.index)
+    )
+    return popups.tolist()
+
+def add_simple_points_layer(map_obj, geolocations: Iterable[Tuple[float,float]], color="red", layer_name="Pickup Points"):
+    """
+    Add same-colored circle markers. Above CLUSTER_THRESHOLD points they go into a
+    MarkerCluster so the browser only draws what is visible at the current zoom.
+    """
+    geolocations = list(geolocations)
+    if len(geolocations) > CLUSTER_THRESHOLD:
+        layer = MarkerCluster(name=layer_name, show=True)
+    else:
+        layer = FeatureGroup(name=layer_name, show=True)
     for lat, lon in geolocations:
         folium.CircleMarker(
             location=(lat, lon),
@@ -398,6 +775,40 @@ def add_simple_points_layer(map_obj, geolocations: List[Tuple[float,float]], col
         ).add_to(layer)
     layer.add_to(map_obj)
 
+def aggregate_heatmap_points(lat_arr: np.ndarray, lon_arr: np.ndarray, cell_deg: float = 0.0005) -> np.ndarray:
+    """
+    Snap points to a cell_deg x cell_deg lat/lon grid and merge each occupied cell into one
+    weighted point at the centroid of its members.
+    Returns (lat, lon, weight) rows with weight = number of points in the cell: Leaflet.heat
+    sums intensities per pixel and counts a raw point as 1, so unnormalized counts keep the
+    aggregated heat as intense as plotting every point.
+    """
+    ix = np.floor((lat_arr - lat_arr.min()) / cell_deg).astype(np.int64)
+    iy = np.floor((lon_arr - lon_arr.min()) / cell_deg).astype(np.int64)
+    key = ix * (int(iy.max()) + 1) + iy
+    _, inverse, counts = np.unique(key, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    lat_c = np.bincount(inverse, weights=lat_arr) / counts
+    lon_c = np.bincount(inverse, weights=lon_arr) / counts
+    return np.column_stack([lat_c, lon_c, counts])
+
+@st.cache_data(show_spinner=False)
+def build_heat_payload(geolocations_df: pd.DataFrame, cell_deg: float = 0.0005) -> np.ndarray:
+    """
+    HeatMap data for the dataframe: raw (N, 2) lat/lon, or grid-aggregated (lat, lon, weight)
+    rows above HEATMAP_AGGREGATE_THRESHOLD points. Cached on the data and cell size only, so
+    style changes (radius/blur/intensity) rebuild the HeatMap layer without redoing this.
+    """
+    # One ndarray (folium iterates it directly). Very large inputs are pre-binned into
+    # weighted grid cells: the rendered heat looks the same but the browser gets
+    # O(cells) points instead of O(N).
+    # np.array always copies: to_numpy() can hand back a read-only view under copy-on-write
+    coords = np.array(geolocations_df[["lat", "lon"]], dtype=np.float64)
+    if len(coords) > HEATMAP_AGGREGATE_THRESHOLD:
+        coords = aggregate_heatmap_points(coords[:, 0], coords[:, 1], cell_deg=cell_deg)
+    coords[:, :2] = coords_for_json(coords[:, :2])
+    return coords
+
 # ----------------------------- Flexible Map Function (modular + fast) -----------------------------
 
 def create_flexible_map(
@@ -407,6 +818,7 @@ def create_flexible_map(
     heat_radius=15,
     heat_blur=20,
     heat_max_intensity=100,
+    heat_cell_deg=0.0005,
     office_marker=None,
     hyd_files=None,
     map_type="heatmap",
@@ -421,15 +833,19 @@ def create_flexible_map(
     
     # Determine start location
     if geolocations_df is not None and not geolocations_df.empty:
-        start_location = (float(geolocations_df.iloc[0]["lat"]), float(geolocations_df.iloc[0]["lon"]))
+        # scalar .iat access: no row Series is built for the first record
+        first = [geolocations_df["lat"].iat[0], geolocations_df["lon"].iat[0]]
+        start_location = tuple(coords_for_json(first).tolist())
     elif office_marker:
         start_location = (office_marker["lat"], office_marker["lon"])
     elif metro_groups:
-        start_location = metro_groups[0]["line"][0]
+        start_location = tuple(metro_groups[0]["coords"][0].tolist())
     else:
         start_location = (0.0, 0.0)
 
-    m = folium.Map(location=start_location, zoom_start=zoom_start, tiles="CartoDB positron", control_scale=True)
+    # prefer_canvas: draw all vector markers on one <canvas> instead of one SVG node each
+    m = folium.Map(location=start_location, zoom_start=zoom_start, tiles="CartoDB positron",
+                   control_scale=True, prefer_canvas=True)
     folium.TileLayer("OpenStreetMap", name="OpenStreetMap").add_to(m)
 
     # ------------- Geolocation visualization -------------
@@ -438,7 +854,7 @@ def create_flexible_map(
         # Heatmap branch
         if map_type.lower() == "heatmap" or n_points > max_points_for_heatmap:
             layer = FeatureGroup(name="Pickup Heatmap", show=True)
-            coords = geolocations_df[["lat", "lon"]].values.tolist()
+            coords = build_heat_payload(geolocations_df, cell_deg=heat_cell_deg)
             HeatMap(coords, radius=heat_radius, blur=heat_blur, max_intensity=heat_max_intensity).add_to(layer)
             layer.add_to(m)
             
@@ -461,21 +877,17 @@ def create_flexible_map(
                 office_lat = office_marker["lat"]
                 office_lon = office_marker["lon"]
                 radii_m = office_marker.get("radii", [10000, 20000, 30000])
-                # compute distances vectorized (in km)
-                lat_arr = geolocations_df["lat"].to_numpy(dtype=float)
-                lon_arr = geolocations_df["lon"].to_numpy(dtype=float)
-                dist_km = haversine_vectorized(office_lat, office_lon, lat_arr, lon_arr)
+                # bins, labels and colors for these radii (memoized), then
+                # compute distances (in km) & bucketize in one pass
+                bins, bucket_labels, colors = bins_labels_colors(tuple(radii_m))
+                # float32 is ~1 m precise at Earth scale, plenty for km buckets, and halves
+                # the memory traffic of the distance pass
+                lat_arr = geolocations_df["lat"].to_numpy(dtype=np.float32)
+                lon_arr = geolocations_df["lon"].to_numpy(dtype=np.float32)
+                dist_km, bucket_idxs = compute_distance_buckets(office_lat, office_lon, lat_arr, lon_arr, bins)
                 geolocations_df = geolocations_df.copy()
                 geolocations_df["distance_km"] = dist_km
 
-                # compute bins & bucketize
-                bins = make_bins_from_radii(radii_m)
-                bucket_idxs = bucketize_distances(dist_km, bins)  # numpy array of ints
-
-                # make labels and colors
-                bucket_labels = bucket_labels_from_bins(bins)
-                colors = make_color_palette(len(bins))
-
                 # add concentric circles around office
                 add_concentric_circles(m, office_lat, office_lon, radii_meters=radii_m, label=office_marker.get("label","Office"))
 
@@ -496,7 +908,10 @@ def create_flexible_map(
 
             else:
                 # no office: simple colored points (all same color)
-                add_simple_points_layer(m, geolocations_df[["lat", "lon"]].values.tolist(), color="red", layer_name="Pickup Points")
+                # zip the two columns directly instead of materializing N [lat, lon] lists
+                points = zip(coords_for_json(geolocations_df["lat"]).tolist(),
+                             coords_for_json(geolocations_df["lon"]).tolist())
+                add_simple_points_layer(m, points, color="red", layer_name="Pickup Points")
 
     # --- Metro Layers ---
     if metro_groups:
@@ -521,6 +936,39 @@ def create_flexible_map(
     folium.LayerControl(collapsed=True).add_to(m)
     return m, bucket_stats
 
+@st.cache_data(max_entries=16, show_spinner=False)
+def render_map_html(
+    geolocations_df: Optional[pd.DataFrame] = None,
+    metro_groups=None,
+    zoom_start=12,
+    heat_radius=15,
+    heat_blur=20,
+    heat_max_intensity=100,
+    heat_cell_deg=0.0005,
+    office_marker=None,
+    hyd_files=None,
+    map_type="heatmap"
+):
+    """
+    Build the map and render it to a standalone HTML page, cached on every argument
+    (including the dataframe contents). Reruns that don't change any map input reuse the
+    HTML string instead of rebuilding the folium map and re-serializing every layer.
+    Returns (html, bucket_stats).
+    """
+    m, bucket_stats = create_flexible_map(
+        geolocations_df=geolocations_df,
+        metro_groups=metro_groups,
+        zoom_start=zoom_start,
+        heat_radius=heat_radius,
+        heat_blur=heat_blur,
+        heat_max_intensity=heat_max_intensity,
+        heat_cell_deg=heat_cell_deg,
+        office_marker=office_marker,
+        hyd_files=hyd_files,
+        map_type=map_type
+    )
+    return m.get_root().render(), bucket_stats
+
 def build_legend_html(labels: List[str], colors: List[str], title="Legend"):
     """
     Build a small HTML legend. Limited styling but useful.
@@ -585,37 +1033,114 @@ def build_heatmap_legend_html(title="Heatmap Intensity"):
 
 # ----------------------------- Streamlit UI (uses modular functions above) -----------------------------
 
-def main():
-    st.set_page_config(page_title="Metro Heatmap Viewer", layout="wide")
-    st.title("📍 Metro Station & Pickup Visualizer")
-
-    # -- File upload --
-    uploaded_file = st.file_uploader(
-        "📄 Upload File (CSV or Excel with latitude & longitude columns)", 
-        type=["csv", "xlsx", "xls"],
-        help="Supports CSV, Excel (.xlsx, .xls) with columns like: Latitude/Lat, Longitude/Lon/Long"
-    )
+# st.fragment (Streamlit >= 1.37; experimental_fragment since 1.33) reruns only the decorated
+# function when a widget inside it changes. On older Streamlit it is a no-op decorator.
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
 
+@fragment
+def render_map_section(geolocations_df, metro_groups, office_marker, hyd_files):
+    """
+    Map type / heatmap controls, distance summary and the map.
+    Runs as a Streamlit fragment where supported, so moving a heatmap slider reruns only
+    this section instead of the upload parsing and metro loading in main().
+    """
     map_type = st.radio("Select Map Type", ["Heatmap", "Points"], horizontal=True)
 
     # Only show heatmap configuration when heatmap is selected
     if map_type == "Heatmap":
-        col1, col2, col3 = st.columns(3)
+        col1, col2, col3, col4 = st.columns(4)
         with col1:
             heat_radius = st.slider("Heatmap Radius", 1, 50, 20)
         with col2:
             heat_blur = st.slider("Heatmap Blur", 1, 50, 17)
         with col3:
             heat_max_intensity = st.slider("Max Heat Intensity", 10, 500, 100)
+        with col4:
+            heat_cell_deg = st.select_slider(
+                "Heatmap Cell Size (deg)",
+                options=[0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005],
+                value=0.0005,
+                help=f"Grid used to merge points when there are more than {HEATMAP_AGGREGATE_THRESHOLD:,}"
+            )
     else:
         # Default values when not in heatmap mode
         heat_radius = 20
         heat_blur = 17
         heat_max_intensity = 100
+        heat_cell_deg = 0.0005
     
     # Default zoom level
     zoom = 12
 
+    # Render map
+    if (geolocations_df is not None and not geolocations_df.empty) or metro_groups or office_marker or hyd_files:
+        map_html, bucket_stats = render_map_html(
+            geolocations_df=geolocations_df,
+            metro_groups=metro_groups,
+            zoom_start=zoom,
+            heat_radius=heat_radius,
+            heat_blur=heat_blur,
+            heat_max_intensity=heat_max_intensity,
+            heat_cell_deg=heat_cell_deg,
+            office_marker=office_marker,
+            hyd_files=hyd_files,
+            map_type=map_type.lower()
+        )
+        
+        # Display statistics table if we have bucket data
+        if bucket_stats is not None:
+            st.markdown("### 📊 Distance Distribution Summary")
+            
+            # Create dataframe for display
+            stats_data = []
+            total_points = 0
+            for i, label in enumerate(bucket_stats["labels"]):
+                count = bucket_stats["counts"].get(i, 0)
+                total_points += count
+                stats_data.append({
+                    "Distance Range": label,
+                    "Color": bucket_stats["colors"][i],
+                    "Count": count
+                })
+            
+            stats_df = pd.DataFrame(stats_data)
+            
+            # Add percentage column
+            if total_points > 0:
+                stats_df["Percentage"] = (stats_df["Count"] / total_points * 100).round(2).astype(str) + "%"
+            else:
+                stats_df["Percentage"] = "0.00%"
+            
+            # Display with color indicators
+            st.dataframe(
+                stats_df.style.apply(
+                    lambda row: [f'background-color: {row["Color"]}; color: white' if idx == 1 else '' 
+                                for idx in range(len(row))], 
+                    axis=1
+                ),
+                use_container_width=True,
+                hide_index=True
+            )
+            
+            st.metric("Total Points", total_points)
+        
+        # The map is display-only, so a static component is enough: st_folium's
+        # bidirectional bridge would re-serialize the map on every rerun
+        components.html(map_html, height=900)
+    else:
+        st.info("📂 Please upload data or enable metro/office markers to view the map.")
+
+def main():
+    st.set_page_config(page_title="Metro Heatmap Viewer", layout="wide")
+    st.title("📍 Metro Station & Pickup Visualizer")
+
+    # -- File upload --
+    uploaded_file = st.file_uploader(
+        "📄 Upload File (CSV or Excel with latitude & longitude columns)", 
+        type=["csv", "xlsx", "xls"],
+        help="Supports CSV, Excel (.xlsx, .xls) with columns like: Latitude/Lat, Longitude/Lon/Long"
+    )
+
     # Metro options
     st.markdown("### 🚇 Optional: Add Metro Lines")
     with st.expander("Add Metro Markers"):
@@ -660,9 +1185,8 @@ def main():
     metro_groups = []
     if show_Bangalore_metro:
         try:
-            with open("metro-lines-stations.geojson", "r") as f:
-                metro_lines, all_stations = read_metro_data_from_geojson(f)
-                metro_groups = assign_stations_to_closest_line(metro_lines, all_stations)
+            with open("metro-lines-stations.geojson", "rb") as f:
+                metro_groups = load_metro_groups(f.read())
         except FileNotFoundError:
             st.error("⚠️ 'metro-lines-stations.geojson' file not found.")
 
@@ -687,61 +1211,8 @@ def main():
         }
         st.write(f"Using radii (meters): {user_radii}")
 
-    # Render map
-    if (geolocations_df is not None and not geolocations_df.empty) or metro_groups or office_marker or hyd_files:
-        result_map, bucket_stats = create_flexible_map(
-            geolocations_df=geolocations_df,
-            metro_groups=metro_groups,
-            zoom_start=zoom,
-            heat_radius=heat_radius,
-            heat_blur=heat_blur,
-            heat_max_intensity=heat_max_intensity,
-            office_marker=office_marker,
-            hyd_files=hyd_files,
-            map_type=map_type.lower()
-        )
-        
-        # Display statistics table if we have bucket data
-        if bucket_stats is not None:
-            st.markdown("### 📊 Distance Distribution Summary")
-            
-            # Create dataframe for display
-            stats_data = []
-            total_points = 0
-            for i, label in enumerate(bucket_stats["labels"]):
-                count = bucket_stats["counts"].get(i, 0)
-                total_points += count
-                stats_data.append({
-                    "Distance Range": label,
-                    "Color": bucket_stats["colors"][i],
-                    "Count": count
-                })
-            
-            stats_df = pd.DataFrame(stats_data)
-            
-            # Add percentage column
-            if total_points > 0:
-                stats_df["Percentage"] = (stats_df["Count"] / total_points * 100).round(2).astype(str) + "%"
-            else:
-                stats_df["Percentage"] = "0.00%"
-            
-            # Display with color indicators
-            st.dataframe(
-                stats_df.style.apply(
-                    lambda row: [f'background-color: {row["Color"]}; color: white' if idx == 1 else '' 
-                                for idx in range(len(row))], 
-                    axis=1
-                ),
-                use_container_width=True,
-                hide_index=True
-            )
-            
-            st.metric("Total Points", total_points)
-        
-        if result_map:
-            st_folium(result_map, width=1800, height=900)
-    else:
-        st.info("📂 Please upload data or enable metro/office markers to view the map.")
+    # Map type, heatmap styling and the map itself rerun on their own (see render_map_section)
+    render_map_section(geolocations_df, metro_groups, office_marker, hyd_files)
 
 if __name__ == "__main__":
     main()